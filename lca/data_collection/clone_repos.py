@@ -1,4 +1,5 @@
 import asyncio
+import logging
 import os
 from argparse import ArgumentParser
 from typing import Optional
@@ -6,17 +7,20 @@ from typing import Optional
 from lca.data_collection.github_utils import clone_repo
 from lca.data_collection.process_utils import process_repos
 
+# Clones are bound by disk and network, running more of them at once only makes them compete
+MAX_CONCURRENT_CLONES = max(2, (os.cpu_count() or 1) // 2)
 
-def main(repos_path: str, tokens_path: str, save_dir: str):
+
+def main(repos_path: str, tokens_path: str, save_dir: str, full_history: bool):
     async def _clone_repo(owner: str, name: str, github_token: str) -> Optional[Exception]:
         repo_dir = f"{save_dir}/{owner}__{name}"
         if not os.path.exists(repo_dir):
-            return await clone_repo(owner, name, github_token, repo_dir)
+            return await clone_repo(owner, name, github_token, repo_dir, full_history)
 
         return None
 
     os.makedirs(save_dir, exist_ok=True)
-    asyncio.run(process_repos(_clone_repo, repos_path, tokens_path, batch_size=10))
+    asyncio.run(process_repos(_clone_repo, repos_path, tokens_path, concurrency=MAX_CONCURRENT_CLONES))
 
 
 if __name__ == "__main__":
@@ -46,6 +50,21 @@ if __name__ == "__main__":
         help="Path to the directory where collected data will be saved",
     )
 
+    argparser.add_argument(
+        "--full-history",
+        action="store_true",
+        help="Clone all commits of all branches instead of the last commit of the default branch",
+    )
+
+    argparser.add_argument(
+        "--log-level",
+        type=str,
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Logging level",
+    )
+
     args = argparser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
-    main(args.repos_path, args.tokens_path, args.save_dir)
+    main(args.repos_path, args.tokens_path, args.save_dir, args.full_history)
@@ -1,39 +1,118 @@
 import asyncio
+import logging
 import os
 from argparse import ArgumentParser
-from typing import Optional
+from collections import deque
+from typing import Deque, Iterator, Optional
 
 import aiohttp
 
-from lca.data_collection.github_utils import GITHUB_API_URL, make_github_http_request
-from lca.data_collection.process_utils import dump_repo_data_to_jsonl, get_github_tokens, get_repos, process_repos
-
-
-async def _process_repos_under_http_session(repos_path: str, tokens_path: str, search_object: str, save_dir: str):
-    async with aiohttp.ClientSession() as http_session:
-
-        async def _collect_repo_data(owner: str, name: str, github_token: str) -> Optional[Exception]:
-            current_url = f"{GITHUB_API_URL}/repos/{owner}/{name}/{search_object}?per_page=100&state=all"
-
-            while current_url is not None:
-                print(f"Processing: {current_url}")
-
-                github_api_response_or_error = await make_github_http_request(http_session, github_token, current_url)
-                if isinstance(github_api_response_or_error, Exception):
-                    return github_api_response_or_error
-
-                data = github_api_response_or_error.data
-                dump_repo_data_to_jsonl(owner, name, data, save_dir)
-                current_url = github_api_response_or_error.headers.get("next", None)
-
-            return None
-
-        await process_repos(_collect_repo_data, repos_path, tokens_path, batch_size=10)
-
-
-def main(repos_path: str, tokens_path: str, search_object: str, save_dir: str):
+from lca.data_collection.github_utils import (
+    GITHUB_API_URL,
+    GithubApiResponseCache,
+    create_github_http_session,
+    get_github_page_urls,
+    make_github_http_request,
+)
+from lca.data_collection.process_utils import RepoDataDumper, process_repos
+
+PAGES_REQUESTED_CONCURRENTLY = 4
+
+logger = logging.getLogger(__name__)
+
+
+async def _collect_repo_data(
+    http_session: aiohttp.ClientSession,
+    dumper: RepoDataDumper,
+    cache: Optional[GithubApiResponseCache],
+    search_object: str,
+    owner: str,
+    name: str,
+    github_token: str,
+) -> Optional[Exception]:
+    def _request_page(url: str) -> asyncio.Task:
+        logger.debug("Processing: %s", url)
+        return asyncio.create_task(make_github_http_request(http_session, github_token, url, cache=cache))
+
+    # Following pages are requested before the current one is dumped, so dumping overlaps with the network round trips.
+    # If the first page links to the last one by page number, all page urls are known and several pages are requested
+    # at once, otherwise (e.g. cursor based links) pages are requested one by one following "next" links
+    page_requests: Deque[asyncio.Task] = deque(
+        [_request_page(f"{GITHUB_API_URL}/repos/{owner}/{name}/{search_object}?per_page=100&state=all")]
+    )
+    page_urls: Optional[Iterator[str]] = None
+    is_first_page = True
+
+    try:
+        while page_requests:
+            github_api_response_or_error = await page_requests.popleft()
+            if isinstance(github_api_response_or_error, Exception):
+                return github_api_response_or_error
+
+            # Only the first page decides how pages are requested, so pages already dumped are never requested again
+            last_url = github_api_response_or_error.headers.get("last", None)
+            next_url = github_api_response_or_error.headers.get("next", None)
+            if is_first_page and last_url is not None:
+                last_page_urls = get_github_page_urls(last_url)
+                if last_page_urls:
+                    page_urls = iter(last_page_urls)
+            if page_urls is None and next_url is not None:
+                page_requests.append(_request_page(next_url))
+            is_first_page = False
+
+            if page_urls is not None:
+                while len(page_requests) < PAGES_REQUESTED_CONCURRENTLY:
+                    page_url = next(page_urls, None)
+                    if page_url is None:
+                        break
+                    page_requests.append(_request_page(page_url))
+
+            await dumper.dump(owner, name, github_api_response_or_error.data)
+    finally:
+        for page_request in page_requests:
+            page_request.cancel()
+        await dumper.close_repo(owner, name)
+
+    return None
+
+
+async def _process_repos_under_http_session(
+    repos_path: str,
+    tokens_path: str,
+    search_object: str,
+    save_dir: str,
+    concurrency: int,
+    cache: Optional[GithubApiResponseCache],
+):
+    async with create_github_http_session() as http_session, RepoDataDumper(save_dir) as dumper:
+        await process_repos(
+            lambda owner, name, github_token: _collect_repo_data(
+                http_session, dumper, cache, search_object, owner, name, github_token
+            ),
+            repos_path,
+            tokens_path,
+            concurrency=concurrency,
+        )
+
+
+def main(
+    repos_path: str,
+    tokens_path: str,
+    search_object: str,
+    save_dir: str,
+    concurrency: int,
+    cache_path: Optional[str],
+):
     os.makedirs(save_dir, exist_ok=True)
-    asyncio.run(_process_repos_under_http_session(repos_path, tokens_path, search_object, save_dir))
+
+    cache = GithubApiResponseCache(cache_path) if cache_path is not None else None
+    try:
+        asyncio.run(
+            _process_repos_under_http_session(repos_path, tokens_path, search_object, save_dir, concurrency, cache)
+        )
+    finally:
+        if cache is not None:
+            cache.close()
 
 
 if __name__ == "__main__":
@@ -71,9 +150,33 @@ if __name__ == "__main__":
         help="Path to the directory where collected data will be saved",
     )
 
-    args = argparser.parse_args()
+    argparser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=10,
+        help="Max number of repos processed simultaneously",
+    )
+
+    argparser.add_argument(
+        "--cache-path",
+        type=str,
+        default=None,
+        help="Path to SQLite file where responses are cached to be revalidated on the next run instead of downloaded. "
+        "It keeps a copy of every collected page, so it takes about as much disk space as the collected data",
+    )
+
+    argparser.add_argument(
+        "--log-level",
+        type=str,
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Logging level, DEBUG also shows every requested page",
+    )
 
-    repos = get_repos(args.repos_path)
-    tokens = get_github_tokens(args.tokens_path)
+    args = argparser.parse_args()
+    if args.concurrency < 1:
+        argparser.error(f"--concurrency must be a positive number, got {args.concurrency}")
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
-    main(args.repos_path, args.tokens_path, args.search_object, args.save_dir)
+    main(args.repos_path, args.tokens_path, args.search_object, args.save_dir, args.concurrency, args.cache_path)
@@ -1,39 +1,67 @@
 import asyncio
 import dataclasses
+import functools
+import json
 import logging
+import random
+import re
+import sqlite3
 import subprocess
 import time
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import List, Optional, Tuple, Union
-from urllib.parse import urlparse
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlencode, urlparse
 
 import aiohttp
-from tenacity import after_log, before_sleep_log, retry, retry_if_result, stop_after_attempt, wait_fixed
+from tenacity import (
+    after_log,
+    before_sleep_log,
+    retry,
+    retry_if_result,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
 GITHUB_API_TRIES_LIMIT = 10
 
 SECONDARY_LIMIT_SLEEP_TIME = 30
 OTHER_ERRORS_SLEEP_TIME = 10
+OTHER_ERRORS_MAX_SLEEP_TIME = 120
 
 GITHUB_API_URL = "https://api.github.com"
+GITHUB_GRAPHQL_URL = f"{GITHUB_API_URL}/graphql"
+GITHUB_REPOSITORY_URL_PATTERN = re.compile(r"https?://github\.com/(?P<owner>[^/?#]+)/(?P<name>[^/?#]+)(?:[?#].*)?$")
 TIME_DIVERGENCE_CONST = 300
 
 REPOSITORIES_START_DATE = datetime.fromisoformat("2008-01-01T00:00:00")
 REPOSITORIES_PER_SINGLE_TOKEN_PERIOD_IN_DAYS = 30
 REPOSITORIES_PAGE_SIZE = 100
 REPOSITORIES_MAX_AMOUNT_PER_SEARCH = 850.0
+REPOSITORIES_PROCESSED_CONCURRENTLY = 16
+REPOSITORIES_PER_GRAPHQL_REQUEST = 50
+BRANCHES_PER_REPOSITORY = 100
 
 MAX_OPEN_HTTP_CONNECTIONS = 512
+MAX_OPEN_HTTP_CONNECTIONS_PER_HOST = 32
+HTTP_KEEPALIVE_TIMEOUT = 75
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+
+RESPONSE_CACHE_COMMIT_INTERVAL = 100
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 """
 Github API specific headers
 """
-RETRY_AFTER = "Retry-After"  # Indicates when the request should be retried after hitting secondary rate limit
+RETRY_AFTER = "Retry-After"  # Indicates in seconds when the request should be retried after hitting a rate limit
 X_RATELIMIT_RESET = "X-RateLimit-Reset"  # Indicates when the primary rate limit will be reset
+ETAG = "ETag"  # Validator of the response content, sent back in "If-None-Match" header of conditional requests
+LAST_MODIFIED = "Last-Modified"  # Validator sent back in "If-Modified-Since" header of conditional requests
 
 
 @dataclasses.dataclass(frozen=True)
@@ -69,7 +97,8 @@ class GithubApiRequestQuery:
 @dataclasses.dataclass(frozen=True)
 class GithubApiResponse:
     """
-    Basic Github API response with one header "next" (link to the next page of results in search) if it exists
+    Basic Github API response with headers "next" and "last" (links to the next and the last pages of results in
+    search) if they exist. Their urls are taken from rel="next" and rel="last" entries of the Link header.
     """
 
     data: dict
@@ -89,6 +118,92 @@ class GithubApiListRepositoriesResponse:
     next_page_url: Optional[str]
 
 
+@dataclasses.dataclass(frozen=True)
+class GithubApiCachedResponse:
+    """
+    Github API response stored with validators used to revalidate it by conditional requests
+    """
+
+    etag: Optional[str]
+    last_modified: Optional[str]
+    response: GithubApiResponse
+
+
+class GithubApiResponseCache:
+    """
+    Cache of Github API responses keyed by url, kept in memory or persisted to a SQLite file to be reused across runs.
+    Cached urls are requested conditionally, and 304 Not Modified responses do not count against the rate limit.
+    Persisted cache is read and written in a dedicated thread, so queries and (de)serialization of pages do not block
+    the event loop; writes are committed in batches of RESPONSE_CACHE_COMMIT_INTERVAL responses and on close.
+    The file keeps a full copy of every cached page, so it takes about as much disk space as the collected data.
+    """
+
+    def __init__(self, db_path: Optional[str] = None) -> None:
+        """
+        :param db_path: path to SQLite file to persist responses to or None to keep them in memory
+        """
+        self._responses: Dict[str, GithubApiCachedResponse] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._uncommitted_count = 0
+
+        if db_path is not None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            # Connection is used only by the executor thread after it is set up here
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, data TEXT, headers TEXT)"
+            )
+
+    async def get(self, url: str) -> Optional[GithubApiCachedResponse]:
+        if self._db is None:
+            return self._responses.get(url)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._select, self._db, url)
+
+    async def put(self, url: str, cached_response: GithubApiCachedResponse):
+        if self._db is None:
+            self._responses[url] = cached_response
+            return
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._insert, self._db, url, cached_response)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def _select(db: sqlite3.Connection, url: str) -> Optional[GithubApiCachedResponse]:
+        row = db.execute("SELECT etag, last_modified, data, headers FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+
+        etag, last_modified, data, headers = row
+        return GithubApiCachedResponse(etag, last_modified, GithubApiResponse(json.loads(data), json.loads(headers)))
+
+    def _insert(self, db: sqlite3.Connection, url: str, cached_response: GithubApiCachedResponse):
+        db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (
+                url,
+                cached_response.etag,
+                cached_response.last_modified,
+                json.dumps(cached_response.response.data),
+                json.dumps(cached_response.response.headers),
+            ),
+        )
+        self._uncommitted_count += 1
+        if self._uncommitted_count == RESPONSE_CACHE_COMMIT_INTERVAL:
+            db.commit()
+            self._uncommitted_count = 0
+
+
 GithubApiResponseOrError = Union[GithubApiResponse, Exception]
 GithubRepositoryOrError = Union[GithubRepository, Exception]
 GithubApiListRepositoriesResponseOrError = Union[GithubApiListRepositoriesResponse, Exception]
@@ -106,18 +221,64 @@ class NotRetryableGithubApiError(Exception):
 
 
 # General requests methods
+def create_github_http_session() -> aiohttp.ClientSession:
+    """
+    Create http session with a connection pool tuned for crawling Github API: connections and resolved DNS entries
+    are reused across pages and repositories instead of reconnecting for each request.
+    Must be called from a running event loop.
+    :return: http session
+    """
+    connector = aiohttp.TCPConnector(
+        limit=MAX_OPEN_HTTP_CONNECTIONS,
+        limit_per_host=MAX_OPEN_HTTP_CONNECTIONS_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        # Aborted TLS connections are closed forcibly instead of leaking their sockets over a long crawl
+        enable_cleanup_closed=True,
+    )
+    # No total timeout: rate limit handlers may sleep for minutes while holding the response
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
 def return_last_value(retry_state):
     """return the result of the last call attempt"""
     if retry_state.args:
-        logger.error(f"Not processed: url {retry_state.args[-1]}")
+        logger.error("Not processed: url %s", retry_state.args[-1])
     else:
-        logger.error(f"Not processed: args - {retry_state.args} kwargs - {retry_state.kwargs}")
+        logger.error("Not processed: args - %s kwargs - %s", retry_state.args, retry_state.kwargs)
     return retry_state.outcome.result()
 
 
+def parse_github_datetime(timestamp: str) -> datetime:
+    """
+    Parse a timestamp from Github API response, e.x. 2011-01-26T19:01:12Z
+    :param timestamp: ISO 8601 timestamp in UTC with a trailing "Z"
+    :return: timezone aware datetime
+    """
+    # fromisoformat accepts "Z" only since python 3.11
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_github_headers(github_token: str) -> Mapping[str, str]:
+    """
+    Get request headers with github authorization. Headers are built once per token and shared between requests.
+    :param github_token: GitHub auth token
+    :return: read-only headers mapping
+    """
+    return MappingProxyType(
+        {
+            "Authorization": f"token {github_token}",
+            "Accept": "application/vnd.github.mercy-preview+json",  # allows to retrieve topics from repositories
+        }
+    )
+
+
 @retry(
     reraise=True,
-    wait=wait_fixed(OTHER_ERRORS_SLEEP_TIME),
+    # Random exponential wait keeps requests failed at the same moment from retrying all at once
+    wait=wait_random_exponential(multiplier=OTHER_ERRORS_SLEEP_TIME, max=OTHER_ERRORS_MAX_SLEEP_TIME),
     stop=stop_after_attempt(GITHUB_API_TRIES_LIMIT),
     retry=retry_if_result(lambda res: isinstance(res, Exception) and not isinstance(res, NotRetryableGithubApiError)),
     before_sleep=before_sleep_log(logger, logging.INFO),
@@ -125,7 +286,10 @@ def return_last_value(retry_state):
     retry_error_callback=return_last_value,
 )
 async def make_github_http_request(
-    http_session: aiohttp.ClientSession, github_token: str, url: str
+    http_session: aiohttp.ClientSession,
+    github_token: str,
+    url: str,
+    cache: Optional[GithubApiResponseCache] = None,
 ) -> GithubApiResponseOrError:
     """
     Make http request for specified url with github authorization and return http response body
@@ -133,28 +297,48 @@ async def make_github_http_request(
     :param http_session: http session
     :param github_token: GitHub auth token
     :param url: url to open
+    :param cache: cache of responses to revalidate with a conditional request instead of downloading again
     :return: response body and important headers or throws an exception
     """
 
-    headers = {
-        "Authorization": f"token {github_token}",
-        "Accept": "application/vnd.github.mercy-preview+json",  # allows to retrieve topics from repositories
-    }
+    headers = get_github_headers(github_token)
+
+    cached_response = await cache.get(url) if cache is not None else None
+    if cached_response is not None:
+        headers = dict(headers)
+        if cached_response.etag is not None:
+            headers["If-None-Match"] = cached_response.etag
+        if cached_response.last_modified is not None:
+            headers["If-Modified-Since"] = cached_response.last_modified
 
     try:
-        logger.debug(f"Trying to make a request: {url}")
+        logger.debug("Trying to make a request: %s", url)
         async with http_session.get(url, headers=headers) as response:
             status_code = response.status
 
             if status_code == 200:
                 response_headers = {}
-                if "next" in response.links and "url" in response.links["next"]:
-                    response_headers["next"] = response.links["next"]["url"]
+                links = response.links
+                for relation in ("next", "last"):
+                    link = links.get(relation)
+                    if link is not None and "url" in link:
+                        response_headers[relation] = str(link["url"])
 
                 logger.debug("Success")
-                return GithubApiResponse(await response.json(), response_headers)
+                # Body is parsed from raw bytes, skipping content type checks and decoding to str in response.json()
+                github_api_response = GithubApiResponse(json.loads(await response.read()), response_headers)
+
+                etag, last_modified = response.headers.get(ETAG), response.headers.get(LAST_MODIFIED)
+                if cache is not None and (etag is not None or last_modified is not None):
+                    await cache.put(url, GithubApiCachedResponse(etag, last_modified, github_api_response))
+
+                return github_api_response
 
-            elif status_code == 403:
+            elif status_code == 304 and cached_response is not None:
+                logger.debug("Not modified")
+                return cached_response.response
+
+            elif status_code in [403, 429]:
                 return await handle_github_rate_limit(response)
 
             elif status_code == 504:
@@ -168,7 +352,7 @@ async def make_github_http_request(
                 # 451 - Unavailable For Legal Reasons
                 response_json = await response.json()
                 error_message = response_json.get("message", f'No "message" key in response. HTTP code {status_code}.')
-                logger.error(f"{error_message} for {url}; {response}")
+                logger.error("%s for %s; %s", error_message, url, response)
                 return NotRetryableGithubApiError(error_message)
             else:
                 error_message = f"HTTP code {status_code} for {url}; {response}"
@@ -179,6 +363,75 @@ async def make_github_http_request(
         error_message = f"Error happened while performing the request for {url}: {e}"
         return GithubApiError(error_message)
 
+    except json.JSONDecodeError as e:
+        error_message = f"Error happened while parsing the response for {url}: {e}"
+        return GithubApiError(error_message)
+
+
+@retry(
+    reraise=True,
+    wait=wait_random_exponential(multiplier=OTHER_ERRORS_SLEEP_TIME, max=OTHER_ERRORS_MAX_SLEEP_TIME),
+    stop=stop_after_attempt(GITHUB_API_TRIES_LIMIT),
+    retry=retry_if_result(lambda res: isinstance(res, Exception) and not isinstance(res, NotRetryableGithubApiError)),
+    before_sleep=before_sleep_log(logger, logging.INFO),
+    after=after_log(logger, logging.INFO),
+    retry_error_callback=return_last_value,
+)
+async def make_github_graphql_request(
+    http_session: aiohttp.ClientSession,
+    github_token: str,
+    query: str,
+    variables: dict,
+) -> GithubApiResponseOrError:
+    """
+    Make Github GraphQL API request with github authorization and return data from the response body
+    or throw an aggregated error. Parts of the query which failed (e.x. not found repositories) are null in the data.
+    :param http_session: http session
+    :param github_token: GitHub auth token
+    :param query: GraphQL query
+    :param variables: values of the query variables
+    :return: response data or throws an exception
+    """
+    try:
+        logger.debug("Trying to make a GraphQL request")
+        async with http_session.post(
+            GITHUB_GRAPHQL_URL, headers=get_github_headers(github_token), json={"query": query, "variables": variables}
+        ) as response:
+            status_code = response.status
+
+            if status_code == 200:
+                response_json = json.loads(await response.read())
+                for error in response_json.get("errors", []):
+                    logger.warning("GraphQL error: %s", error.get("message"))
+
+                # Errors which failed the whole query (e.x. rate limiting) leave no data at all
+                if response_json.get("data") is None:
+                    error_message = f"No data in GraphQL response; {response_json.get('errors')}"
+                    logger.error(error_message)
+                    return GithubApiError(error_message)
+
+                logger.debug("Success")
+                return GithubApiResponse(response_json["data"], {})
+
+            elif status_code in [403, 429]:
+                return await handle_github_rate_limit(response)
+
+            elif status_code == 504:
+                return await handle_github_ban(response)
+
+            else:
+                error_message = f"HTTP code {status_code} for GraphQL request; {response}"
+                logger.error(error_message)
+                return GithubApiError(error_message)
+
+    except aiohttp.ClientError as e:
+        error_message = f"Error happened while performing GraphQL request: {e}"
+        return GithubApiError(error_message)
+
+    except json.JSONDecodeError as e:
+        error_message = f"Error happened while parsing GraphQL response: {e}"
+        return GithubApiError(error_message)
+
 
 async def handle_github_ban(response: aiohttp.ClientResponse) -> GithubApiError:
     sleep_time = 600
@@ -190,8 +443,9 @@ async def handle_github_ban(response: aiohttp.ClientResponse) -> GithubApiError:
 
 async def handle_github_rate_limit(response: aiohttp.ClientResponse) -> GithubApiError:
     """
-    Rate limit errors from github have 403 HTTP status. This method handles rate limit errors and propagates other errors.
-    To fix exceeded rate limit this method performs a delay before making the next call.
+    Rate limit errors from github have 403 or 429 HTTP status. This method handles rate limit errors and propagates other
+    errors. To fix exceeded rate limit this method performs a delay before making the next call, honoring the
+    `Retry-After` and `X-RateLimit-Reset` headers when github sends them.
     :param response: http response
     :return: an error about rate limiting or an error during parsing the response
     """
@@ -201,21 +455,31 @@ async def handle_github_rate_limit(response: aiohttp.ClientResponse) -> GithubAp
         message = response_json["message"]
 
         if message.startswith("You have exceeded a secondary rate limit."):
-            sleep_time = int(response.headers[RETRY_AFTER])
+            sleep_time = int(response.headers.get(RETRY_AFTER, SECONDARY_LIMIT_SLEEP_TIME))
             error_message = f"Secondary Github API rate limit was exceeded. {response.url} sleep for {sleep_time}"
             logger.warning(error_message)
             await asyncio.sleep(sleep_time)
             return GithubApiError(error_message)
 
-        elif message.startswith("API rate limit exceeded"):
+        elif message.startswith("API rate limit exceeded") and X_RATELIMIT_RESET in response.headers:
             reset_time = int(response.headers[X_RATELIMIT_RESET])
-            #  add some time because of possible time divergence
-            sleep_time = reset_time - int(time.time()) + TIME_DIVERGENCE_CONST
+            #  add some time because of possible time divergence and a random part,
+            #  so requests of different tokens waiting for the same reset do not resume simultaneously
+            sleep_time = (
+                reset_time - int(time.time()) + TIME_DIVERGENCE_CONST + random.randint(0, TIME_DIVERGENCE_CONST)
+            )
             error_message = f"Github API rate limit exceeded. {response.url} sleep for {sleep_time}"
             logger.warning(error_message)
             await asyncio.sleep(sleep_time)
             return GithubApiError(error_message)
 
+        elif RETRY_AFTER in response.headers:
+            sleep_time = int(response.headers[RETRY_AFTER])
+            error_message = f"Github API asked to retry later. {response.url} sleep for {sleep_time}"
+            logger.warning(error_message)
+            await asyncio.sleep(sleep_time)
+            return GithubApiError(error_message)
+
         else:
             error_message = f"Not a rate limiting error. {response}"
             logger.error(error_message)
@@ -231,7 +495,11 @@ async def handle_github_rate_limit(response: aiohttp.ClientResponse) -> GithubAp
 
 
 async def get_repository_meta(
-    http_session: aiohttp.ClientSession, github_token: str, owner: str, name: str
+    http_session: aiohttp.ClientSession,
+    github_token: str,
+    owner: str,
+    name: str,
+    cache: Optional[GithubApiResponseCache] = None,
 ) -> GithubRepositoryOrError:
     """
     Get github repository representation with id, default branch and meta
@@ -239,11 +507,12 @@ async def get_repository_meta(
     :param github_token: GitHub auth token
     :param owner: repository owner
     :param name: repository name
+    :param cache: cache of responses to revalidate
     :return: GithubRepository with appropriate data or an error
     """
     url = f"{GITHUB_API_URL}/repos/{owner}/{name}"
 
-    github_api_response_or_error = await make_github_http_request(http_session, github_token, url)
+    github_api_response_or_error = await make_github_http_request(http_session, github_token, url, cache=cache)
     if isinstance(github_api_response_or_error, Exception):
         return github_api_response_or_error
 
@@ -252,7 +521,7 @@ async def get_repository_meta(
     repo_name = github_api_response_or_error.data["name"]
     repo_owner = github_api_response_or_error.data["owner"]["login"]
     repo_collection_time = datetime.now(timezone.utc)
-    repo_created_at = datetime.fromisoformat(github_api_response_or_error.data["created_at"].replace("Z", "+00:00"))
+    repo_created_at = parse_github_datetime(github_api_response_or_error.data["created_at"])
 
     return GithubRepository(
         repo_id=repo_id,
@@ -279,17 +548,22 @@ async def get_repository_last_commit_sha(
     :param branch: repository branch
     :return: sha or an error
     """
-    url = f"{GITHUB_API_URL}/repos/{owner}/{name}/commits/{branch}"
+    # Branch reference is a tiny object, unlike the commit which comes with its files and diff stats
+    url = f"{GITHUB_API_URL}/repos/{owner}/{name}/git/ref/heads/{branch}"
 
     github_api_response_or_error = await make_github_http_request(http_session, github_token, url)
     if isinstance(github_api_response_or_error, Exception):
         return github_api_response_or_error
 
-    return github_api_response_or_error.data["sha"]
+    return github_api_response_or_error.data["object"]["sha"]
 
 
 async def get_all_branches_from_repository(
-    http_session: aiohttp.ClientSession, github_token: str, owner: str, name: str
+    http_session: aiohttp.ClientSession,
+    github_token: str,
+    owner: str,
+    name: str,
+    cache: Optional[GithubApiResponseCache] = None,
 ) -> Union[List[str], Exception]:
     """
     Get all branch names from repository.
@@ -297,17 +571,80 @@ async def get_all_branches_from_repository(
     :param github_token: GitHub auth token
     :param owner: repository owner
     :param name: repository name
+    :param cache: cache of responses to revalidate
     :return: list of branch names or an error
     """
     url = f"{GITHUB_API_URL}/repos/{owner}/{name}/branches"
 
-    github_api_response_or_error = await make_github_http_request(http_session, github_token, url)
+    github_api_response_or_error = await make_github_http_request(http_session, github_token, url, cache=cache)
     if isinstance(github_api_response_or_error, Exception):
         return github_api_response_or_error
 
     return [branch["name"] for branch in github_api_response_or_error.data]
 
 
+async def get_repositories_branches(
+    http_session: aiohttp.ClientSession,
+    github_token: str,
+    repositories: List[Tuple[str, str]],
+    process_all_branches: bool,
+) -> Union[Dict[Tuple[str, str], List[Tuple[str, str]]], Exception]:
+    """
+    Get branch names with their last commit sha for many repositories with a single GraphQL request.
+    Repositories which were not found or have no default branch (e.x. empty ones) are missing from the result.
+    :param http_session: http session
+    :param github_token: GitHub auth token
+    :param repositories: list of repository owners and names
+    :param process_all_branches: get all branches (up to BRANCHES_PER_REPOSITORY) or only default branch
+    :return: branch names with last commit sha by repository owner and name or an error
+    """
+    if process_all_branches:
+        branches_query = (
+            f'refs(refPrefix: "refs/heads/", first: {BRANCHES_PER_REPOSITORY}) '
+            "{ nodes { name target { oid } } pageInfo { hasNextPage } }"
+        )
+    else:
+        branches_query = "defaultBranchRef { name target { oid } }"
+
+    # Each repository is queried under its own alias, so all of them fit into one query
+    variables = {}
+    parameters = []
+    repository_queries = []
+    for i, (owner, name) in enumerate(repositories):
+        variables[f"owner{i}"] = owner
+        variables[f"name{i}"] = name
+        parameters.append(f"$owner{i}: String!, $name{i}: String!")
+        repository_queries.append(f"r{i}: repository(owner: $owner{i}, name: $name{i}) {{ {branches_query} }}")
+    query = f"query({', '.join(parameters)}) {{ {' '.join(repository_queries)} }}"
+
+    github_api_response_or_error = await make_github_graphql_request(http_session, github_token, query, variables)
+    if isinstance(github_api_response_or_error, Exception):
+        return github_api_response_or_error
+
+    repositories_branches = {}
+    for i, repository in enumerate(repositories):
+        repository_data = github_api_response_or_error.data.get(f"r{i}")
+        if repository_data is None:
+            continue
+
+        if process_all_branches:
+            refs = repository_data["refs"]["nodes"]
+            if repository_data["refs"]["pageInfo"]["hasNextPage"]:
+                logger.warning(
+                    "Repository %s/%s has more than %s branches, the rest are skipped",
+                    *repository,
+                    BRANCHES_PER_REPOSITORY,
+                )
+        elif repository_data["defaultBranchRef"] is not None:
+            refs = [repository_data["defaultBranchRef"]]
+        else:
+            continue
+
+        repositories_branches[repository] = [(ref["name"], ref["target"]["oid"]) for ref in refs]
+
+    return repositories_branches
+
+
 # Auto collection of repository information
 
 
@@ -355,7 +692,7 @@ async def list_and_process_repositories_by_url(
     :param process_all_branches: process all available branches or only default branch
     :return: list of repos or an error
     """
-    logger.info(f"Starting to process repositories found by this url: {url}")
+    logger.info("Starting to process repositories found by this url: %s", url)
     timestamp = datetime.now(timezone.utc)
     github_api_response_or_error = await make_github_http_request(http_session, github_token, url)
     if isinstance(github_api_response_or_error, Exception):
@@ -369,9 +706,9 @@ async def list_and_process_repositories_by_url(
 
     if total_count > REPOSITORIES_MAX_AMOUNT_PER_SEARCH:
         logger.warning(
-            f"Total count of repositories {total_count}"
-            f" exceeds the maximum amount per search {REPOSITORIES_MAX_AMOUNT_PER_SEARCH};"
-            f" skipping fetching repository datas"
+            "Total count of repositories %s exceeds the maximum amount per search %s; skipping fetching repository datas",
+            total_count,
+            REPOSITORIES_MAX_AMOUNT_PER_SEARCH,
         )
         return GithubApiListRepositoriesResponse(
             total_count=total_count,
@@ -380,27 +717,71 @@ async def list_and_process_repositories_by_url(
             next_page_url=next_page_url,
         )
 
-    for item in github_api_response_or_error.data["items"]:
+    items = github_api_response_or_error.data["items"]
+
+    # Branches of found repositories are requested in batches with GraphQL,
+    # repositories missing from its responses fall back to REST requests
+    repositories_keys = [(item["owner"]["login"], item["name"]) for item in items]
+    repositories_branches: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+    for branches_or_error in await asyncio.gather(
+        *[
+            get_repositories_branches(
+                http_session,
+                github_token,
+                repositories_keys[i : i + REPOSITORIES_PER_GRAPHQL_REQUEST],
+                process_all_branches,
+            )
+            for i in range(0, len(repositories_keys), REPOSITORIES_PER_GRAPHQL_REQUEST)
+        ]
+    ):
+        if isinstance(branches_or_error, Exception):
+            logger.warning("Falling back to REST requests for branches: %s", branches_or_error)
+        else:
+            repositories_branches.update(branches_or_error)
+
+    # REST requests for branches are made concurrently, but bounded to not hit secondary rate limit
+    semaphore = asyncio.Semaphore(REPOSITORIES_PROCESSED_CONCURRENTLY)
+
+    async def _collect_repositories(item: dict) -> List[GithubRepository]:
         repo_id = int(item["id"])
         repo_name = item["name"]
         repo_owner = item["owner"]["login"]
         repo_collection_time = timestamp
-        repo_created_at = datetime.fromisoformat(item["created_at"].replace("Z", "+00:00"))
+        repo_created_at = parse_github_datetime(item["created_at"])
 
-        collected_repositories = await iterate_over_branches_and_init_last_commit_sha(
-            http_session=http_session,
-            github_token=github_token,
-            repo_id=repo_id,
-            repo_name=repo_name,
-            repo_owner=repo_owner,
-            repo_collection_time=repo_collection_time,
-            repo_created_at=repo_created_at,
-            repo_specific_branch=item["default_branch"],
-            repo_branches_url=item["branches_url"].partition("{")[0],
-            repo_meta=item,
-            process_all_branches=process_all_branches,
-        )
+        branches = repositories_branches.get((repo_owner, repo_name))
+        if branches is not None:
+            return [
+                GithubRepository(
+                    repo_id=repo_id,
+                    name=repo_name,
+                    owner=repo_owner,
+                    created_at=repo_created_at,
+                    branch=branch_name,
+                    commit_sha=commit_sha,
+                    collection_timestamp=repo_collection_time,
+                    meta=item,
+                    problems=None,
+                )
+                for branch_name, commit_sha in branches
+            ]
 
+        async with semaphore:
+            return await iterate_over_branches_and_init_last_commit_sha(
+                http_session=http_session,
+                github_token=github_token,
+                repo_id=repo_id,
+                repo_name=repo_name,
+                repo_owner=repo_owner,
+                repo_collection_time=repo_collection_time,
+                repo_created_at=repo_created_at,
+                repo_specific_branch=item["default_branch"],
+                repo_branches_url=item["branches_url"].partition("{")[0],
+                repo_meta=item,
+                process_all_branches=process_all_branches,
+            )
+
+    for collected_repositories in await asyncio.gather(*[_collect_repositories(item) for item in items]):
         repositories.extend(collected_repositories)
 
     return GithubApiListRepositoriesResponse(
@@ -446,9 +827,9 @@ async def iterate_over_branches_and_init_last_commit_sha(
     repositories = []
 
     if process_all_branches:
-        logger.debug(f"Processing all branches for {repo_owner}/{repo_name}")
+        logger.debug("Processing all branches for %s/%s", repo_owner, repo_name)
 
-        branches_url = repo_branches_url.partition("{")[0]
+        branches_url = f'{repo_branches_url.partition("{")[0]}?per_page={BRANCHES_PER_REPOSITORY}'
         branches_response_or_error = await make_github_http_request(http_session, github_token, branches_url)
 
         if isinstance(branches_response_or_error, Exception):
@@ -466,6 +847,13 @@ async def iterate_over_branches_and_init_last_commit_sha(
             repositories.append(repository)
 
         else:
+            if "next" in branches_response_or_error.headers:
+                logger.warning(
+                    "Repository %s/%s has more than %s branches, the rest are skipped",
+                    repo_owner,
+                    repo_name,
+                    BRANCHES_PER_REPOSITORY,
+                )
             for branch in branches_response_or_error.data:
                 branch_name = branch["name"]
                 commit_sha = branch["commit"]["sha"] if branch["commit"] else None
@@ -483,7 +871,7 @@ async def iterate_over_branches_and_init_last_commit_sha(
                 repositories.append(repository)
 
     else:
-        logger.debug(f"Processing branch {repo_specific_branch} for {repo_owner}/{repo_name}")
+        logger.debug("Processing branch %s for %s/%s", repo_specific_branch, repo_owner, repo_name)
 
         commit_sha_or_error = await get_repository_last_commit_sha(
             http_session=http_session,
@@ -516,17 +904,55 @@ def parse_github_url(url: str) -> Tuple[str, str]:
     :param url: github url
     :return: tuple with repository owner and name
     """
+    # Plain repository urls are matched directly, others are left to the general url parsing
+    match = GITHUB_REPOSITORY_URL_PATTERN.match(url)
+    if match is not None:
+        return match.group("owner"), match.group("name")
+
     owner, name = urlparse(url).path.split("/")[1:]
     return owner, name
 
 
-async def clone_repo(owner: str, name: str, github_token: str, repo_dir: str) -> Optional[Exception]:
+def get_github_page_urls(last_page_url: str) -> List[str]:
+    """
+    Build urls of all pages of paginated results except the first one from the link to the last page
+    https://api.github.com/repos/o/r/pulls?state=all&page=3 -> [...&page=2, ...&page=3]
+    :param last_page_url: url from the "last" link of the first page of results
+    :return: list of page urls in the order of pages, empty if the link is not numbered by a page parameter
+    """
+    parsed_url = urlparse(last_page_url)
+    query = dict(parse_qsl(parsed_url.query))
+    if not query.get("page", "").isdigit():
+        return []
+    last_page = int(query["page"])
+    return [parsed_url._replace(query=urlencode({**query, "page": page})).geturl() for page in range(2, last_page + 1)]
+
+
+async def clone_repo(
+    owner: str, name: str, github_token: str, repo_dir: str, full_history: bool = False
+) -> Optional[Exception]:
+    """
+    Clone github repository with git. By default only the last commit of the default branch is fetched.
+    :param owner: repository owner
+    :param name: repository name
+    :param github_token: GitHub auth token
+    :param repo_dir: directory to clone repository to
+    :param full_history: fetch all commits of all branches instead of a shallow clone
+    :return: an error if clone failed or None
+    """
+    depth_args = [] if full_history else ["--depth=1"]
+    git_cmd = ["git", "clone", *depth_args, f"https://{github_token}@github.com/{owner}/{name}.git", repo_dir]
     try:
-        git_cmd = ["git", "clone", f"https://{github_token}@github.com/{owner}/{name}.git", repo_dir]
         process = await asyncio.create_subprocess_exec(*git_cmd)
-        stdout, stderr = await process.communicate()
-        print(f"Repository {owner}/{name} cloned successfully to repo_dir.")
-        return None
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to clone repository {owner}/{name}", e)
+        await process.wait()
+    except OSError as e:
         return e
+
+    if process.returncode != 0:
+        # Command in the error is shown without the token
+        return subprocess.CalledProcessError(
+            process.returncode, ["git", "clone", *depth_args, f"https://github.com/{owner}/{name}.git", repo_dir]
+        )
+
+    logger.info("Repository %s/%s cloned successfully to %s", owner, name, repo_dir)
+    return None
@@ -1,38 +1,46 @@
 import asyncio
+import logging
 import os
 import re
 from argparse import ArgumentParser
-from datetime import datetime
-from typing import Optional
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import islice
+from typing import Deque, Iterable, Optional
 
 import aiohttp
-from lxml import html
+from lxml import etree, html
 
-from lca.data_collection.process_utils import dump_repo_data_to_jsonl, process_repos_data
+from lca.data_collection.process_utils import RepoDataDumper, process_repos_data
 
+LINKS_DUMP_CHUNK_SIZE = 1000
+LINKS_CHUNKS_PROCESSED_CONCURRENTLY = 4
 
-async def _get_linked_issues_from_html(html_url: str, http_session: aiohttp.ClientSession) -> Optional[list[str]]:
-    """To slow to run as can not be batched."""
-    time_start = datetime.now()
-    async with http_session.get(html_url) as response:
-        response.raise_for_status()
-        html_content = await response.text()
-        time_end = datetime.now()
-        print(f"Time load html: {time_end - time_start}")
+LINKED_ISSUES_XPATH = etree.XPath('//form[@aria-label="Link issues"]/span/a')
 
-        time_start = datetime.now()
-        doc = html.fromstring(html_content.encode("utf-8"))
-        linked_issues = [str(e.get("href")) for e in doc.xpath('//form[@aria-label="Link issues"]/span/a')]
-        time_end = datetime.now()
-        print(f"Time parse html: {time_end - time_start}")
 
-        return linked_issues
+def _parse_linked_issues(html_content: bytes) -> list[str]:
+    # Raw bytes are parsed directly, lxml detects the encoding from the page's meta charset
+    doc = html.fromstring(html_content)
+    return [str(e.get("href")) for e in LINKED_ISSUES_XPATH(doc)]
 
 
-def _get_linked_issue_from_comment(comment_body: str, owner: str, name: str):
-    """https://docs.github.com/en/get-started/writing-on-github/working-with-advanced-formatting/autolinked-references-and-urls"""
+async def _get_linked_issues_from_html(html_url: str, http_session: aiohttp.ClientSession) -> Optional[list[str]]:
+    """
+    Too slow to run as can not be batched.
+    Parsing is done in a worker thread, so pages of other pulls keep loading meanwhile.
+    """
+    async with http_session.get(html_url) as response:
+        response.raise_for_status()
+        html_content = await response.read()
+        return await asyncio.to_thread(_parse_linked_issues, html_content)
+
 
-    patterns = [
+# Compiled once at module level; each format is scanned separately, so overlapping references of different formats
+# (e.x. ".../issues/12#13") are all found, in the same order as before
+LINKED_ISSUE_PATTERNS = [
+    re.compile(pattern)
+    for pattern in [
         # https://github.com/jlord/sheetsee.js/issues/26
         r"https:\/\/github\.com\/[^\/\s]+\/[^\/\s]+\/issues\/(?P<issue_number>\d+)",
         # #26
@@ -42,42 +50,74 @@ def _get_linked_issue_from_comment(comment_body: str, owner: str, name: str):
         # jlord/sheetsee.js#26
         r"[^\/\s]+\/[^\/\s]+#(?P<issue_number>\d+)",
     ]
+]
+
+
+def _get_linked_issue_from_comment(comment_body: Optional[str], issues_url: str):
+    """https://docs.github.com/en/get-started/writing-on-github/working-with-advanced-formatting/autolinked-references-and-urls"""
 
-    linked_issues_ids = []
-    for p in patterns:
-        linked_issues_ids += re.findall(p, comment_body)
+    # Most comments have no body or contain none of the characters every reference format requires
+    if not comment_body or ("#" not in comment_body and "GH-" not in comment_body and "/issues/" not in comment_body):
+        return []
 
-    return [f"https://api.github.com/repos/{owner}/{name}/issues/{issue_id}" for issue_id in linked_issues_ids]
+    return [
+        issues_url + issue_number for pattern in LINKED_ISSUE_PATTERNS for issue_number in pattern.findall(comment_body)
+    ]
 
 
-async def _get_links_from_comments(owner: str, name: str, items: list[dict], save_dir: str) -> Optional[Exception]:
-    prs_issues_links = []
+def _get_links_from_comments_chunk(comments: list[tuple[str, str, Optional[str]]], issues_url: str) -> list[dict]:
+    return [
+        {
+            "comment_url": comment_url,
+            "issue_url": issue_url,
+            "linked_issue_urls": _get_linked_issue_from_comment(body, issues_url),
+        }
+        for comment_url, issue_url, body in comments
+    ]
 
-    for item in items:
-        prs_issues_links.append(
-            {
-                "comment_url": item["url"],
-                "issue_url": item["issue_url"],
-                "linked_issue_urls": _get_linked_issue_from_comment(item["body"], owner, name),
-            }
-        )
 
-    dump_repo_data_to_jsonl(owner, name, prs_issues_links, save_dir)
+async def _get_links_from_comments(
+    owner: str, name: str, items: Iterable[dict], dumper: RepoDataDumper, executor: Executor
+) -> Optional[Exception]:
+    # Comments are read lazily and scanned in chunks by worker processes, only the fields used for links are sent
+    # to them. Links are handed to the dumper chunk by chunk in the order of comments, and only a few chunks are in
+    # progress at once, so memory does not grow with the size of the repo
+    loop = asyncio.get_running_loop()
+    issues_url = f"https://api.github.com/repos/{owner}/{name}/issues/"
+    comments = ((item["url"], item["issue_url"], item["body"]) for item in items)
+    chunks_links: Deque[asyncio.Future] = deque()
+
+    try:
+        while chunk := list(islice(comments, LINKS_DUMP_CHUNK_SIZE)):
+            chunks_links.append(loop.run_in_executor(executor, _get_links_from_comments_chunk, chunk, issues_url))
+            if len(chunks_links) == LINKS_CHUNKS_PROCESSED_CONCURRENTLY:
+                await dumper.dump(owner, name, await chunks_links.popleft())
+
+        while chunks_links:
+            await dumper.dump(owner, name, await chunks_links.popleft())
+    finally:
+        for chunk_links in chunks_links:
+            chunk_links.cancel()
+        await dumper.close_repo(owner, name)
 
     return None
 
 
+async def _process_repos_data_with_dumper(data_path: str, save_dir: str):
+    with ProcessPoolExecutor() as executor:
+        async with RepoDataDumper(save_dir) as dumper:
+            await process_repos_data(
+                lambda owner, name, items, _: _get_links_from_comments(owner, name, items, dumper, executor),
+                data_path,
+                tokens_path=None,
+                concurrency=10,
+            )
+
+
 def main(data_path: str, save_dir: str):
     os.makedirs(save_dir, exist_ok=True)
 
-    asyncio.run(
-        process_repos_data(
-            lambda owner, name, items, _: _get_links_from_comments(owner, name, items, save_dir),
-            data_path,
-            tokens_path=None,
-            batch_size=10,
-        )
-    )
+    asyncio.run(_process_repos_data_with_dumper(data_path, save_dir))
 
 
 if __name__ == "__main__":
@@ -99,6 +139,15 @@ if __name__ == "__main__":
         help="Path to the directory where collected data will be saved",
     )
 
+    argparser.add_argument(
+        "--log-level",
+        type=str,
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Logging level",
+    )
+
     args = argparser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
     main(args.data_path, args.save_dir)
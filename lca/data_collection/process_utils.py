@@ -1,106 +1,233 @@
 import asyncio
 import json
+import logging
 import os
-from typing import Any, Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Optional
+
+DUMP_QUEUE_SIZE = 1000
+# O_BINARY is needed on Windows only, where files are opened in text mode by default
+DUMP_FILE_FLAGS = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+
+logger = logging.getLogger(__name__)
 
 
 def get_repos(repos_path: str) -> list[tuple[str, str]]:
     repos = []
-    with open(repos_path, "r") as f_repos:
-        for line in f_repos:
-            owner, name = line.strip().split("/")
+    for line in Path(repos_path).read_text().splitlines():
+        if line.strip():
+            owner, _, name = line.strip().partition("/")
+            if not owner or not name or "/" in name:
+                raise ValueError(f"Malformed repository {line.strip()!r} in {repos_path}, expected <owner>/<name>")
             repos.append((owner, name))
-        return repos
+    return repos
 
 
 def get_github_tokens(tokens_path: str) -> list[str]:
-    with open(tokens_path, "r") as f_tokens:
-        return [line.strip() for line in f_tokens]
+    return [line.strip() for line in Path(tokens_path).read_text().splitlines() if line.strip()]
+
+
+class GithubTokenPool:
+    """
+    Hands out Github tokens to repos at the moment their processing starts, choosing the token used by the fewest
+    repos in progress. Repos stuck behind a rate limited token do not make other repos wait for the same token.
+    """
+
+    def __init__(self, github_tokens: Optional[list[str]]):
+        self._repos_in_progress = {github_token: 0 for github_token in github_tokens or []}
+
+    @contextmanager
+    def acquire(self) -> Iterator[Optional[str]]:
+        """Yields the least used token or None if pool is empty"""
+        if not self._repos_in_progress:
+            yield None
+            return
+
+        github_token = min(self._repos_in_progress, key=self._repos_in_progress.__getitem__)
+        self._repos_in_progress[github_token] += 1
+        try:
+            yield github_token
+        finally:
+            self._repos_in_progress[github_token] -= 1
 
 
 async def process_repos(
     process_repo: Callable[[str, str, Optional[str]], Any],
     repos_path: str,
     tokens_path: Optional[str] = None,
-    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
 ):
     """
     Runs `process_repo` on each repo from file located in `repos_path`
     :param process_repo: func that takes owner, name and optional token as input and does some processing task on repo
     :param repos_path: path to file where list of repos is stored
     :param tokens_path: path to file where list of tokens is stored
-    :param batch_size: size of repos batch to process simultaneously or None if process without batching
+    :param concurrency: max number of repos processed simultaneously or None if process all of them at once
     """
-    repos = get_repos(repos_path)
-    github_tokens = get_github_tokens(tokens_path) if tokens_path is not None else None
-    if batch_size is None:
-        await _process_repos(process_repo, repos, github_tokens)
-    else:
-        for i in range(0, len(repos), batch_size):
-            await _process_repos(process_repo, repos[i : i + batch_size], github_tokens)
+    token_pool = GithubTokenPool(get_github_tokens(tokens_path) if tokens_path is not None else None)
 
+    async def _process_repo(repo: tuple[str, str]):
+        owner, name = repo
+        with token_pool.acquire() as github_token:
+            return await process_repo(owner, name, github_token)
 
-async def _process_repos(
-    process_repo: Callable[[str, str, Optional[str]], Any],
-    repos: list[tuple[str, str]],
-    github_tokens: Optional[list[str]],
-):
-    prepare_repositories_coroutines = []
-
-    for i, (owner, name) in enumerate(repos):
-        github_token = github_tokens[i % len(github_tokens)] if github_tokens is not None else None
-        prepare_repositories_coroutines.append(process_repo(owner, name, github_token))
-
-    for repositories_future in asyncio.as_completed(prepare_repositories_coroutines):
-        await repositories_future
+    await _run_concurrently(_process_repo, get_repos(repos_path), concurrency)
 
 
 async def process_repos_data(
-    process_repo_data: Callable[[str, str, list[dict], Optional[str]], Any],
+    process_repo_data: Callable[[str, str, Iterable[dict], Optional[str]], Any],
     repos_data_path: str,
     tokens_path: Optional[str] = None,
-    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
 ):
     """
     Runs `process_repo` on each repo from file located in `repos_path`
     :param process_repo_data: func that takes owner, name, repo data items and optional token as input and does some processing task on repo's data
     :param repos_data_path: path to file where list of repos' data is stored
     :param tokens_path: path to file where list of tokens is stored
-    :param batch_size: size of repos batch to process simultaneously or None if process without batching
+    :param concurrency: max number of repos processed simultaneously or None if process all of them at once
     """
-    filenames = os.listdir(repos_data_path)
-    github_tokens = get_github_tokens(tokens_path) if tokens_path is not None else None
-    if batch_size is None:
-        await _process_repos_data(process_repo_data, repos_data_path, filenames, github_tokens)
-    else:
-        for i in range(0, len(filenames), batch_size):
-            await _process_repos_data(process_repo_data, repos_data_path, filenames[i : i + batch_size], github_tokens)
+    # Scandir entries cache file type, so no extra stat call is needed per file
+    with os.scandir(repos_data_path) as entries:
+        data_files = [entry for entry in entries if entry.is_file() and entry.name.endswith(".jsonl")]
 
+    token_pool = GithubTokenPool(get_github_tokens(tokens_path) if tokens_path is not None else None)
 
-async def _process_repos_data(
-    process_repo_data: Callable[[str, str, list[dict], Optional[str]], Any],
-    repos_data_path: str,
-    filenames: list[str],
-    github_tokens: Optional[list[str]] = None,
-):
-    prepare_repositories_coroutines = []
-    for i, filename in enumerate(filenames):
-        file_path = os.path.join(repos_data_path, filename)
-
-        if os.path.isfile(file_path) and filename.endswith(".jsonl"):
-            # Parse from <owner>__<name>.jsonl
-            owner, name = filename.split(".")[0].split("__")
-            github_token = github_tokens[i % len(github_tokens)] if github_tokens is not None else None
-            with open(file_path, "r") as f:
-                items = [json.loads(line) for line in f]
-                prepare_repositories_coroutines.append(process_repo_data(owner, name, items, github_token))
-
-    for repositories_future in asyncio.as_completed(prepare_repositories_coroutines):
-        await repositories_future
-
-
-def dump_repo_data_to_jsonl(owner: str, name: str, items: list[dict], data_folder: str):
-    data_path = os.path.join(data_folder, f"{owner}__{name}.jsonl")
-    with open(data_path, "a") as f_data_output:
-        for item in items:
-            f_data_output.write(json.dumps(item) + "\n")
+    async def _process_repo_data(data_file: os.DirEntry):
+        # Parse from <owner>__<name>.jsonl
+        owner, name = data_file.name.split(".")[0].split("__")
+        items = read_jsonl(data_file.path)
+        with token_pool.acquire() as github_token:
+            return await process_repo_data(owner, name, items, github_token)
+
+    await _run_concurrently(_process_repo_data, data_files, concurrency)
+
+
+async def _run_concurrently(process: Callable[[Any], Awaitable[Any]], args: list, concurrency: Optional[int]):
+    """
+    Runs `process` on each of `args` keeping at most `concurrency` of them in progress.
+    Workers pull args from a shared iterator, so only `concurrency` coroutines exist at any moment.
+    Failure of one arg, either raised or returned as an exception, is logged and does not stop the others.
+    """
+    if concurrency is not None and concurrency < 1:
+        raise ValueError(f"Concurrency must be a positive number, got {concurrency}")
+
+    args_iterator = iter(args)
+
+    async def _worker():
+        for arg in args_iterator:
+            try:
+                result = await process(arg)
+            except Exception:
+                logger.exception("Failed to process %s", arg)
+                continue
+
+            if isinstance(result, Exception):
+                logger.error("Failed to process %s: %s", arg, result)
+
+    # No more workers than args, so e.g. a single repo is processed by a single coroutine
+    workers_count = min(concurrency, len(args)) if concurrency is not None else len(args)
+    await asyncio.gather(*[_worker() for _ in range(workers_count)])
+
+
+def read_jsonl(data_path: str) -> Iterator[dict]:
+    """
+    Lazily reads jsonl file line by line, so only items being processed are kept in memory
+    :param data_path: path to jsonl file
+    :return: iterator over parsed items
+    """
+    with open(data_path, "rb") as f:
+        for line in f:
+            if not line.isspace():
+                yield json.loads(line)
+
+
+def to_jsonl_bytes(items: list[dict]) -> bytes:
+    """Serializes items to a single jsonl block, so they can be appended to a file with one write"""
+    if not items:
+        return b""
+    # One join over the serialized items instead of concatenating a newline to each of them
+    return ("\n".join(map(json.dumps, items)) + "\n").encode("utf-8")
+
+
+class RepoDataDumper:
+    """
+    Appends repos' data to `<owner>__<name>.jsonl` files in `data_folder`.
+    Files are kept open between dumps as raw append-only descriptors, each dumped page is appended with a single
+    unbuffered write.
+    Serialization and writes are done by a background task in a dedicated writer thread, so dumping does not block
+    the event loop and files are written in the order data was dumped; the queue of pending pages is bounded to apply
+    backpressure on producers. Dumped items must not be modified afterwards, as they are serialized later.
+    Must be used as an async context manager.
+    """
+
+    def __init__(self, data_folder: str, queue_size: int = DUMP_QUEUE_SIZE):
+        self.data_folder = data_folder
+        self._fds: dict[tuple[str, str], int] = {}
+        # None items are a request to close the repo's file
+        self._queue: asyncio.Queue[tuple[str, str, Optional[list[dict]]]] = asyncio.Queue(maxsize=queue_size)
+        self._writer_task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def __aenter__(self) -> "RepoDataDumper":
+        self._writer_task = asyncio.create_task(self._write_loop())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._queue.join()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            await asyncio.gather(self._writer_task, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+        self.close()
+
+    async def dump(self, owner: str, name: str, items: list[dict]):
+        await self._queue.put((owner, name, items))
+
+    async def close_repo(self, owner: str, name: str):
+        """Flushes and closes the file of the processed repo once its pending data is written"""
+        await self._queue.put((owner, name, None))
+
+    def close(self):
+        for fd in self._fds.values():
+            os.close(fd)
+        self._fds.clear()
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Everything queued while the previous batch was written goes to the writer thread in one call
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await loop.run_in_executor(self._executor, self._write_batch, batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: list[tuple[str, str, Optional[list[dict]]]]):
+        for owner, name, items in batch:
+            try:
+                self._write(owner, name, items)
+            except Exception:
+                logger.exception("Failed to dump data of %s/%s", owner, name)
+
+    def _write(self, owner: str, name: str, items: Optional[list[dict]]):
+        if items is None:
+            fd = self._fds.pop((owner, name), None)
+            if fd is not None:
+                os.close(fd)
+            return
+
+        fd = self._fds.get((owner, name))
+        if fd is None:
+            data_path = os.path.join(self.data_folder, f"{owner}__{name}.jsonl")
+            fd = os.open(data_path, DUMP_FILE_FLAGS, 0o644)
+            self._fds[(owner, name)] = fd
+
+        payload = memoryview(to_jsonl_bytes(items))
+        while payload:
+            payload = payload[os.write(fd, payload) :]